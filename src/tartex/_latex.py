@@ -9,17 +9,16 @@ Helper function to compile latex file in a temp dir
 """
 
 import logging as log
+import mmap
+import os
 import re
 import shutil
 import subprocess
 import sys
 from pathlib import Path
 
-from rich.live import Live
-from rich.spinner import Spinner
-
-# Match only lines beginning with INPUT
-INPUT_RE = re.compile(r"^INPUT")
+# Match (in bytes) whole lines beginning with INPUT
+INPUT_RE = re.compile(rb"^INPUT.*$", re.MULTILINE)
 INPUT_STY = re.compile(r"^INPUT\s.*.(cls|def|sty)")
 INPUT_FONTS = re.compile(r"^INPUT\s.*.(pfb|tfm)")
 FONT_PUBLIC = re.compile(r"/public/.*/")
@@ -27,6 +26,10 @@ FONT_PUBLIC = re.compile(r"/public/.*/")
 
 def run_latexmk(filename, mode, compdir):
     """Helper function to actually compile the latex file in a tmpdir"""
+    # Only import rich console machinery when a compile is actually needed
+    from rich.live import Live
+    from rich.spinner import Spinner
+
     # Generate fls file from tex file by running latexmk
     latexmk_cmd = [
         shutil.which("latexmk"),
@@ -72,21 +75,32 @@ def run_latexmk(filename, mode, compdir):
     return fls_path
 
 
-def fls_input_files(fls_fileobj, lof_excl, skip_files, *, sty_files=False):
-    """Helper function to return list on files marked as 'INPUT' in fls file"""
+def fls_input_files(fls_path, lof_excl, skip_files, *, sty_files=False):
+    """Helper function to return set of files marked as 'INPUT' in fls file"""
     deps = set()
     pkgs = {"System": set(), "Local": set()}
-    for line in fls_fileobj:
-        if INPUT_RE.match(line):
-            p = Path(line.split()[-1])
-            if (
-                not p.is_absolute()
-                and (p.as_posix() not in deps)
-                and (p.as_posix() not in lof_excl)
-                and (p.suffix not in skip_files)
-            ):
-                deps.add(p.as_posix())
-                log.info("Add file: %s", p.as_posix())
+    with open(fls_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # Cannot mmap empty file
+            return deps, pkgs
+        # Let the regex engine skip over all other lines of the memory mapped
+        # file; INPUT lines are often repeated, so only keep distinct ones
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            input_lines = dict.fromkeys(
+                m.group() for m in INPUT_RE.finditer(mm)
+            )
+
+    log_info = log.getLogger().isEnabledFor(log.INFO)
+    for line in (ln.decode("utf-8") for ln in input_lines):
+        p = Path(line.split()[-1])
+        if (
+            not p.is_absolute()
+            and ((dep := p.as_posix()) not in deps)
+            and (dep not in lof_excl)
+            and (p.suffix not in skip_files)
+        ):
+            deps.add(dep)
+            if log_info:
+                log.info("Add file: %s", dep)
 
         if sty_files:
             if INPUT_STY.match(line):
@@ -109,4 +123,4 @@ def fls_input_files(fls_fileobj, lof_excl, skip_files, *, sty_files=False):
                         fontdir = p.parent.name
                     pkgs["System"].add(fontdir)
 
-    return list(deps), pkgs
+    return deps, pkgs
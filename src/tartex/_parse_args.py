@@ -13,8 +13,6 @@ from pathlib import Path
 from textwrap import wrap
 
 from rich import print as richprint
-from rich.markdown import Markdown
-from rich.syntax import Syntax
 
 from tartex.__about__ import __appname__ as APPNAME  # noqa: N812
 from tartex.__about__ import __version__
@@ -109,6 +107,9 @@ class CompletionPrintAction(argparse.Action):
     # Note that correct __call__ signature requires all positional args even if
     # they are not used in this method itself
     def __call__(self, parser, nsp, vals, opt_str=None):  # noqa: ARG002
+        # Imported here as rich.markdown is slow to import and rarely needed
+        from rich.markdown import Markdown
+
         richprint(Markdown(COMPLETIONS_GUIDE))
         parser.exit()
 
@@ -167,6 +168,9 @@ class ZshCompletionInstall(CompletionInstall):
     """Completion install action for Zsh shell"""
 
     def __call__(self, parser, namespace, values, option_strings=None):
+        # Imported here as rich.syntax is slow to import and rarely needed
+        from rich.syntax import Syntax
+
         ZshCompletion().install()
         richprint(
             "\n"
@@ -8,19 +8,21 @@
 import fnmatch
 import json
 import logging as log
-import math
+import mmap
 import os
 import re
+import shutil
+import stat
+import subprocess
 import sys
-import tarfile as tar
-import time
-from contextlib import suppress
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from io import BytesIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 from rich import print as richprint
-from rich.prompt import Prompt
 
 from tartex import _latex
 from tartex._parse_args import parse_args
@@ -53,6 +55,29 @@ TAR_EXT = ["bz2", "gz", "xz"]
 # Default compression
 TAR_DEFAULT_COMP = "gz"
 
+# Multi-threaded compressors (with options to write to stdout) to pipe the tar
+# stream through instead of using python's single-threaded compression, if
+# available in PATH; compression levels are the same as tarfile's defaults
+TAR_PARALLEL_COMP = {
+    "bz2": ["pbzip2", "-c"],
+    "gz": ["pigz", "-9", "-c"],
+    "xz": ["xz", "-T0", "-c"],
+}
+
+# Number of input files to read in background threads ahead of the one being
+# written to the tarball
+TAR_READ_AHEAD = 4
+
+# Largest file to read ahead into memory; bigger ones are streamed from disk
+TAR_READ_MAX = 4 << 20
+
+# Buffer size for copying member contents into the tar stream, and for the
+# tarball file itself when compressing in-process
+TAR_BUFSIZE = 1 << 20
+
+# Match bib file name in \bibliography{...} at the beginning of any line
+BIB_RE = re.compile(rb"^\\bibliography\{([^}]*)\}", re.MULTILINE)
+
 
 def strip_tarext(filename):
     """Strip '.tar(.EXT)' from filename"""
@@ -64,6 +89,62 @@ def strip_tarext(filename):
     return basename
 
 
+def _strip_prefix(path, prefix):
+    """
+    Return posix style str for path relative to prefix, a dir path ending in a
+    path separator; path must be known to lie inside prefix (e.g. globbed from
+    it) as no checks are done
+    """
+    return os.fspath(path)[len(prefix) :].replace(os.sep, "/")
+
+
+def _scan_files(root):
+    """
+    Yield os.DirEntry objects for all non-dir entries under root, recursively.
+    Like '**' globs, symlinked dirs are not descended into and unreadable dirs
+    are silently skipped.
+    """
+    dirs = [root]
+    while dirs:
+        try:
+            entries = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    yield entry
+
+
+def _read_file(fname):
+    """
+    Return full contents of fname if it is a regular file of at most
+    TAR_READ_MAX bytes, else None
+    """
+    st = os.lstat(fname)
+    if not stat.S_ISREG(st.st_mode) or st.st_size > TAR_READ_MAX:
+        return None
+    with open(fname, "rb") as f:
+        return f.read()
+
+
+def _read_ahead(fnames, ahead=TAR_READ_AHEAD):
+    """
+    Yield (fname, future) pairs in the order of fnames, where the future
+    resolves to _read_file(fname); files are read in a pool of threads working
+    up to 'ahead' files in advance of the consumer
+    """
+    with ThreadPoolExecutor(max_workers=ahead) as pool:
+        pending = deque()
+        for fname in fnames:
+            pending.append((fname, pool.submit(_read_file, fname)))
+            if len(pending) > ahead:
+                yield pending.popleft()
+        yield from pending
+
+
 def _full_if_not_rel_path(src, dest):
     p = Path(src).resolve()
     with suppress(ValueError):
@@ -93,6 +174,11 @@ def _summary_msg(nfiles, tarname=None):
         richprint(f"[cyan]Summary: {_num_tag(nfiles)} to include.[/]")
 
 
+def _pkglist_bytes(pkgs):
+    """Return json encoded bytes for pkgs dict"""
+    return json.dumps(pkgs, cls=SetEncoder).encode("utf8")
+
+
 class TarTeX:
     """
     Class to help build  a tarball including all source files needed to
@@ -143,37 +229,40 @@ class TarTeX:
             self.tar_file.with_suffix(f".tar.{self.tar_ext}"),
         )
 
+        # Source dir as str with trailing separator, for cheap relative paths
+        self.src_prefix = os.path.join(self.main_file.parent, "")
+
         self.req_supfiles = {}
         self.add_files = self.args.add.split(",") if self.args.add else []
         excludes = self.args.excl.split(",") if self.args.excl else []
-        excl_lists = (self.main_file.parent.glob(f"{L}") for L in excludes)
-
-        self.excl_files = [
-            f.relative_to(self.main_file.parent).as_posix()
-            for L in excl_lists
-            for f in L
-        ]
+        self.excl_files = frozenset(
+            _strip_prefix(f, self.src_prefix)
+            for L in excludes
+            for f in self.main_file.parent.glob(L)
+        )
 
         # If .bbl/.ind is missing in source dir, then it is not in
         # self.excl_files (result of globbing files in srcdir) even if the user
         # passes a matching wildcard to exclude it with "-x".
-        # Extend self.excl_files specifically in these cases
-        for glb in excludes:
-            self.excl_files.extend(
-                [
-                    f
-                    for f in [
-                        self.main_file.with_suffix(f".{g}") for g in SUPP_REQ
-                    ]
-                    if fnmatch.fnmatch(f.name, glb)
-                ]
+        # Keep all patterns compiled into a single regex to check such file
+        # names against instead
+        self.excl_re = (
+            re.compile(
+                "|".join(
+                    f"(?:{fnmatch.translate(os.path.normcase(g))})"
+                    for g in excludes
+                )
             )
+            if excludes
+            else None
+        )
 
-        if self.excl_files:
-            log.debug(" ".join(excl_lists))
+        # Only build the (possibly long) list of excluded files for logging
+        # if it is actually going to be shown
+        if self.excl_files and log.getLogger().isEnabledFor(log.INFO):
             log.info(
                 "List of excluded files: %s",
-                ", ".join([x.as_posix() for x in self.excl_files]),
+                ", ".join(self.excl_files),
             )
 
         self.force_tex = self.args.latexmk_tex
@@ -181,11 +270,11 @@ class TarTeX:
             # If force_tex is not set by user options,
             # set to ps if source dir contains ps/eps files
             # or to pdf otherwise
-            src_ps = [
-                str(p)
-                for ext in ["eps", "ps"]
-                for p in self.main_file.parent.glob(f"**/*.{ext}")
-            ]
+            # Single walk of the source tree, stopping at the first match
+            src_ps = any(
+                entry.name.endswith((".eps", ".ps"))
+                for entry in _scan_files(self.main_file.parent)
+            )
             self.force_tex = "ps" if src_ps else "pdf"
             log.info(
                 "Latexmk will use %slatex for processing, if needed",
@@ -193,6 +282,7 @@ class TarTeX:
             )
 
         self.pkglist = None
+        self._deps = None  # Cached result of input_files()
 
     def add_user_files(self):
         """
@@ -215,19 +305,18 @@ class TarTeX:
 
     def bib_file(self):
         """Return relative path to bib file"""
-        bibre = re.compile(r"^\\bibliography\{.*\}")
         bibstr = None
         texf = self.main_file.with_suffix(".tex")
-        with open(texf, encoding="utf-8") as f:
-            for line in f:
-                m = bibre.search(line)
-                if m:
-                    bibstr = m.group()
-                    break
+        # Let the regex scan the memory mapped file in one go instead of
+        # decoding and searching it line by line
+        with open(texf, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:  # Cannot mmap empty file
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if m := BIB_RE.search(mm):
+                        bibstr = m.group(1).decode("utf-8")
 
-        if bibstr:
-            bibstr = re.sub(r"^\\bibliography\{", "", bibstr).rstrip("}")
-            bibstr += ".bib" if bibstr.split(".")[-1] != ".bib" else ""
+        if bibstr and not bibstr.endswith(".bib"):
+            bibstr += ".bib"
 
         return Path(bibstr) if bibstr else None
 
@@ -236,11 +325,15 @@ class TarTeX:
         Returns non-system input files needed to compile the main tex file.
         Will try to compile the main tex file using `latexmk` if it cannot find
         the fls file in the same dir.
+
+        The result is cached, so that the LaTeX compile (or .fls parsing) is
+        done only once per object.
         """
-        if (
-            not self.main_file.with_suffix(".fls").exists()
-            or self.args.force_recompile
-        ):
+        if self._deps is not None:
+            return self._deps
+
+        src_fls = self.main_file.with_suffix(".fls")
+        if not src_fls.exists() or self.args.force_recompile:
             with TemporaryDirectory() as compile_dir:
                 log.info(
                     "LaTeX recompile forced"
@@ -255,57 +348,56 @@ class TarTeX:
                     compile_dir,
                 )
 
-                with open(fls_path, encoding="utf-8") as f:
-                    deps, pkgs = _latex.fls_input_files(
-                        f,
-                        self.excl_files,
-                        AUXFILES,
-                        sty_files=self.args.packages,
-                    )
-                    if self.args.packages:
+                deps, pkgs = _latex.fls_input_files(
+                    fls_path,
+                    self.excl_files,
+                    AUXFILES,
+                    sty_files=self.args.packages,
+                )
+                if self.args.packages:
+                    if log.getLogger().isEnabledFor(log.INFO):
                         log.info(
                             "System TeX/LaTeX packages used: %s",
-                            ", ".join(sorted(pkgs["System"]))
-                        )
-
-                        self.pkglist = json.dumps(pkgs, cls=SetEncoder).encode(
-                            "utf8"
+                            ", ".join(sorted(pkgs["System"])),
                         )
+                    self.pkglist = _pkglist_bytes(pkgs)
 
                 for ext in SUPP_REQ:
-                    if app := self._missing_supp(
-                        self.main_file.with_suffix(f".{ext}"), compile_dir, deps
-                    ):
-                        self.req_supfiles[
-                            self.main_file.with_suffix(f".{ext}")
-                        ] = app
+                    supp = self.main_file.with_suffix(f".{ext}")
+                    if app := self._missing_supp(supp, compile_dir, deps):
+                        self.req_supfiles[supp] = app
         else:
             # If .fls exists, this assumes that all INPUT files recorded in it
             # are also included in source dir
-            with open(self.main_file.with_suffix(".fls"), encoding="utf8") as f:
-                deps, pkgs = _latex.fls_input_files(
-                    f, self.excl_files, AUXFILES, sty_files=self.args.packages
-                )
-                if self.args.packages:
-                    self.pkglist = json.dumps(pkgs, cls=SetEncoder).encode(
-                        "utf8"
-                    )
+            deps, pkgs = _latex.fls_input_files(
+                src_fls,
+                self.excl_files,
+                AUXFILES,
+                sty_files=self.args.packages,
+            )
+            if self.args.packages:
+                self.pkglist = _pkglist_bytes(pkgs)
 
         if self.args.bib and (bib := self.bib_file()):
-            deps.append(bib.as_posix())
-            log.info("Add file: %s", deps[-1])
+            deps.add(bib.as_posix())
+            log.info("Add file: %s", bib.as_posix())
 
         if self.add_files:
-            for f in self.add_user_files():
-                f_relpath_str = f.relative_to(self.main_file.parent).as_posix()
-                if f_relpath_str in deps:
-                    log.warning(
-                        "Manually included file %s already added", f_relpath_str
-                    )
-                    continue
-                deps.append(f_relpath_str)
-                log.info("Add user specified file: %s", f_relpath_str)
-
+            # Count matches so files matched by more than one pattern are
+            # also reported
+            user_files = Counter(
+                _strip_prefix(f, self.src_prefix) for f in self.add_user_files()
+            )
+            for f in sorted(user_files):
+                if f in deps or user_files[f] > 1:
+                    log.warning("Manually included file %s already added", f)
+            user_files = user_files.keys() - deps
+            if log.getLogger().isEnabledFor(log.INFO):
+                for f in sorted(user_files):
+                    log.info("Add user specified file: %s", f)
+            deps |= user_files
+
+        self._deps = deps
         return deps
 
     def tar_files(self):
@@ -323,8 +415,7 @@ class TarTeX:
             self._print_list(self.input_files())
         else:
             try:
-                f = tar.open(full_tar_name, mode=f"x:{self.tar_ext}")
-                with f:
+                with self._tar_open(full_tar_name, "x") as f:
                     self._do_tar(f)
                     if self.args.summary:
                         _summary_msg(
@@ -343,9 +434,8 @@ class TarTeX:
                     full_tar_name = self._tar_name_conflict(full_tar_name)
                     # At this stage, there is either a new name for the tar
                     # file or user wants to overwrite existing file. In either
-                    # case, calling tar.open() with 'w' mode should be OK.
-                    f = tar.open(full_tar_name, mode=f"w:{self.tar_ext}")
-                    with f:
+                    # case, opening the tar file with 'w' mode should be OK.
+                    with self._tar_open(full_tar_name, "w") as f:
                         self._do_tar(f)
                         if self.args.summary:
                             _summary_msg(
@@ -362,7 +452,76 @@ class TarTeX:
         os.chdir(self.cwd)
         log.debug("Reset working dir to %s", os.getcwd())
 
+    @contextmanager
+    def _tar_open(self, tpath, mode):
+        """
+        Context manager returning a tar object open for writing to tpath,
+        where mode is one of 'x' or 'w' (as for tarfile.open), compressed
+        according to the tar ext.
+
+        The tar stream is piped through a parallel compressor when one is
+        found in PATH; otherwise python's own compression is used.
+        """
+        import tarfile as tar  # Not needed at all when only listing files
+
+        comp_cmd = TAR_PARALLEL_COMP[self.tar_ext]
+        if not (comp_bin := shutil.which(comp_cmd[0])):
+            with open(tpath, f"{mode}b", buffering=TAR_BUFSIZE) as raw:
+                try:
+                    with tar.open(
+                        fileobj=raw,
+                        mode=f"w:{self.tar_ext}",
+                        copybufsize=TAR_BUFSIZE,
+                    ) as f:
+                        yield f
+                except BaseException:
+                    # Do not leave a truncated tarball behind
+                    raw.close()
+                    tpath.unlink()
+                    raise
+            return
+
+        log.debug("Compressing tar stream with %s", comp_bin)
+        proc = err = None
+        with open(tpath, f"{mode}b") as out:
+            try:
+                with subprocess.Popen(
+                    [comp_bin, *comp_cmd[1:]], stdin=subprocess.PIPE, stdout=out
+                ) as proc, tar.open(
+                    fileobj=proc.stdin, mode="w|", copybufsize=TAR_BUFSIZE
+                ) as f:
+                    yield f
+            except OSError as e:  # Including compressor exiting before EOF
+                err = e
+            except BaseException:
+                out.close()
+                tpath.unlink()
+                raise
+
+        if not (err or proc.returncode):
+            return
+
+        # Do not leave an empty or truncated tarball behind
+        tpath.unlink()
+        if proc is None:
+            log.critical(
+                "Error: cannot run %s, %s", comp_bin, err.strerror.lower()
+            )
+        elif proc.returncode:
+            log.critical(
+                "Error: %s failed with exit status %d",
+                comp_bin,
+                proc.returncode,
+            )
+        elif isinstance(err, BrokenPipeError):
+            log.critical("Error: %s stopped reading tar stream", comp_bin)
+        else:  # Not a compressor failure, e.g. unreadable input file
+            raise err
+        sys.exit(1)
+
     def _tar_name_conflict(self, tpath):
+        from rich.prompt import Prompt  # Only needed in this rare case
+
         richprint(
             "[bold red]A tar file with the same name"
             rf" \[{_full_if_not_rel_path(tpath, self.cwd)}]"
@@ -429,32 +588,48 @@ class TarTeX:
             sys.exit(1)
 
     def _do_tar(self, tar_obj):
-        for dep in self.input_files():
-            # By now, if the file is still missing, this indicates a .fls file
-            # is present in source but some of its INPUT marked entries are
-            # not. That is user error and we simply omit the missing file from
-            # tarball with a warning
+        # Reading of files is overlapped with (compressing and) writing
+        # previous ones to the tarball, which must be done from this thread
+        for dep, contents in _read_ahead(sorted(self.input_files())):
             try:
-                tar_obj.add(dep)
+                tinfo = tar_obj.gettarinfo(dep)
             except FileNotFoundError:
+                # By now, if the file is still missing, this indicates a .fls
+                # file is present in source but some of its INPUT marked
+                # entries are not. That is user error and we simply omit the
+                # missing file from tarball with a warning
                 log.warning(
                     "Skipping INPUT file '%s', not found amongst sources; try"
                     " forcing a LaTeX recompile ('-F').",
                     dep,
                 )
+            else:
+                if tinfo.isdir():
+                    # User specified dirs (via '-a') are added recursively
+                    tar_obj.add(dep)
+                elif not tinfo.isreg():  # Symlinks, etc.
+                    tar_obj.addfile(tinfo)
+                elif (buf := contents.result()) is not None:
+                    tinfo.size = len(buf)  # In case file changed since stat
+                    tar_obj.addfile(tinfo, BytesIO(buf))
+                else:  # Too large to hold in memory
+                    with open(dep, "rb") as f:
+                        tar_obj.addfile(tinfo, f)
+
+        if not (self.args.packages or self.req_supfiles):
+            return
+
+        # Generated members copy mtime and user/group names from the main tex
+        # file, looked up only once; using its mtime rather than the current
+        # time also keeps these headers identical across runs
+        tex_info = tar_obj.getmember(self.main_file.with_suffix(".tex").name)
 
         def _tar_add_bytesio(obj, name):
             tinfo = tar_obj.tarinfo(name)
             tinfo.size = len(obj)
-            tinfo.mtime = int(time.time())
-
-            # Copy user/group names from main.tex file
-            tinfo.uname = tar_obj.getmember(
-                self.main_file.with_suffix(".tex").name
-            ).uname
-            tinfo.gname = tar_obj.getmember(
-                self.main_file.with_suffix(".tex").name
-            ).gname
+            tinfo.mtime = tex_info.mtime
+            tinfo.uname = tex_info.uname
+            tinfo.gname = tex_info.gname
             tar_obj.addfile(tinfo, BytesIO(obj))
 
         if self.args.packages:
@@ -495,13 +670,18 @@ class TarTeX:
 
     def _print_list(self, ls):
         """helper function to print list of files in a pretty format"""
-        idx_width = int(math.log10(len(ls))) + 1
-        for i, f in enumerate(ls):
-            richprint(f"{i+1:{idx_width}}. {f}")
-        for r in self.req_supfiles:
-            richprint(f"{'*':>{idx_width + 1}} {r.name}")
+        idx_width = len(str(len(ls)))
+        # File names need no rich markup processing (which would also mangle
+        # any '[...]' in them), so write them all out in one go
+        lines = [
+            f"{i:{idx_width}}. {f}\n" for i, f in enumerate(sorted(ls), start=1)
+        ]
+        lines.extend(
+            f"{'*':>{idx_width + 1}} {r.name}\n" for r in self.req_supfiles
+        )
         if self.args.packages:
-            richprint(f"{'*':>{idx_width + 1}} {self.pkglist_name}")
+            lines.append(f"{'*':>{idx_width + 1}} {self.pkglist_name}\n")
+        sys.stdout.write("".join(lines))
         if self.args.summary:
             _summary_msg(
                 len(ls) + len(self.req_supfiles) + (1 if self.pkglist else 0)
@@ -509,17 +689,18 @@ class TarTeX:
 
     def _missing_supp(self, fpath, tmpdir, deps):
         """Handle missing supplementary file from orig dir, if req"""
+        tmp_path = Path(tmpdir) / fpath.name
         if (
-            fpath not in deps  # bbl file not in source dir
-            and (Path(tmpdir) / fpath.name).exists()  # Implies it's req
-            and fpath not in self.excl_files  # Not explicitly excluded
+            fpath.name not in deps  # bbl file not in source dir
+            and tmp_path.exists()  # Implies it's req
+            and not (  # Not explicitly excluded
+                self.excl_re
+                and self.excl_re.match(os.path.normcase(fpath.name))
+            )
         ):
             log.debug("Required file '%s' not in source dir", fpath.name)
-            log.info(
-                "Add contents as BytesIO: %s",
-                Path(tmpdir) / fpath.name,
-            )
-            return (Path(tmpdir) / fpath.name).read_bytes()
+            log.info("Add contents as BytesIO: %s", tmp_path)
+            return tmp_path.read_bytes()
 
         return None
 
@@ -8,6 +8,7 @@ Test inclusion and exclusion of .bib files
 """
 
 import tarfile as tar
+from pathlib import Path
 
 from tartex.tartex import TAR_DEFAULT_COMP, TarTeX
 
@@ -35,3 +36,14 @@ def test_bib(datadir, tmpdir):
                 f.getmember("main_bib.bbl").get_info()[attr]
                 == f.getmember(t.main_file.name).get_info()[attr]
             )
+
+
+def test_bib_file(datadir):
+    """Test bib file name lookup from main tex file"""
+    t = TarTeX([str(datadir / "main_bib.tex")])
+    assert t.bib_file() == Path("refs.bib")
+
+    # File name given with '.bib' suffix must not get a second one
+    texf = datadir / "main_bib_suffix.tex"
+    texf.write_text("\\bibliography{refs.bib}\n", encoding="utf-8")
+    assert TarTeX([str(texf)]).bib_file() == Path("refs.bib")
@@ -8,11 +8,15 @@
 Tests for when source dir has .fls file
 """
 
+import errno
+import shutil
+import sys
 import tarfile as tar
+from pathlib import Path
 
 import pytest
 
-from tartex.tartex import TAR_DEFAULT_COMP, TarTeX
+from tartex.tartex import TAR_DEFAULT_COMP, TAR_PARALLEL_COMP, TarTeX
 
 
 @pytest.fixture
@@ -53,3 +57,158 @@ def test_fls_recompile(datadir, flsfile):
 
     with tar.open(f"{t.tar_file!s}.{TAR_DEFAULT_COMP}") as f:
         assert flsfile.replace(".fls", ".bbl") in f.getnames()
+
+
+# Python modules to mimic the parallel compressor used for each option
+COMP_MODULES = {"-j": "bz2", "-J": "lzma", "-z": "gzip"}
+
+
+def fake_compressor(path, code):
+    """Write python code to an executable script at path"""
+    path.write_text(f"#!{sys.executable}\nimport sys\n{code}\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.mark.parametrize("comp_opt", COMP_MODULES)
+def test_fls_compress(datadir, flsfile, comp_opt, monkeypatch):
+    """Without a parallel compressor, python's own compression is used"""
+    monkeypatch.setattr(shutil, "which", lambda _: None)
+    t = TarTeX([str(datadir / flsfile), "-o", str(datadir), comp_opt])
+    t.tar_files()
+
+    with tar.open(f"{t.tar_file!s}.{t.tar_ext}") as f:
+        assert flsfile.replace(".fls", ".tex") in f.getnames()
+
+
+@pytest.mark.parametrize("comp_opt", COMP_MODULES)
+def test_fls_compress_piped(datadir, flsfile, comp_opt, monkeypatch, tmp_path):
+    """Tar stream is piped through parallel compressor when available"""
+    mod = COMP_MODULES[comp_opt]
+    comp = fake_compressor(
+        tmp_path / "comp",
+        f"import {mod}\n"
+        "open(sys.argv[0] + '.args', 'w').write(' '.join(sys.argv[1:]))\n"
+        f"sys.stdout.buffer.write({mod}.compress(sys.stdin.buffer.read()))",
+    )
+    monkeypatch.setattr(shutil, "which", lambda _: comp)
+    t = TarTeX([str(datadir / flsfile), "-o", str(datadir), comp_opt])
+    t.tar_files()
+
+    with tar.open(f"{t.tar_file!s}.{t.tar_ext}") as f:
+        assert flsfile.replace(".fls", ".tex") in f.getnames()
+    assert (tmp_path / "comp.args").read_text() == " ".join(
+        TAR_PARALLEL_COMP[t.tar_ext][1:]
+    )
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "sys.stdin.buffer.read()\nsys.exit(3)",  # Fails after reading input
+        "sys.exit(3)",  # Exits without reading input
+        None,  # Cannot be executed at all
+    ],
+)
+def test_fls_compress_fail(datadir, flsfile, code, monkeypatch, tmp_path):
+    """A failing compressor leaves no tarball behind"""
+    comp = tmp_path / "comp"
+    if code:
+        fake_compressor(comp, code)
+    else:
+        comp.write_text("")
+    monkeypatch.setattr(shutil, "which", lambda _: str(comp))
+    t = TarTeX([str(datadir / flsfile), "-o", str(datadir)])
+    with pytest.raises(SystemExit) as exc:
+        t.tar_files()
+
+    assert exc.value.code == 1
+    assert not Path(f"{t.tar_file!s}.{t.tar_ext}").exists()
+
+
+@pytest.mark.parametrize("piped", [False, True])
+def test_fls_tar_fail(datadir, flsfile, piped, monkeypatch, tmp_path):
+    """An error while writing the tarball leaves no partial tarball behind"""
+    comp = None
+    if piped:
+        comp = fake_compressor(
+            tmp_path / "comp",
+            "import gzip\n"
+            "sys.stdout.buffer.write(gzip.compress(sys.stdin.buffer.read()))",
+        )
+    monkeypatch.setattr(shutil, "which", lambda _: comp)
+
+    def unreadable(fname):
+        raise PermissionError(errno.EACCES, "Permission denied", fname)
+
+    monkeypatch.setattr("tartex.tartex._read_file", unreadable)
+    t = TarTeX([str(datadir / flsfile), "-o", str(datadir)])
+    with pytest.raises(SystemExit) as exc:
+        t.tar_files()
+
+    assert exc.value.code == 1
+    assert not Path(f"{t.tar_file!s}.{t.tar_ext}").exists()
+
+
+def test_fls_list(datadir, flsfile, capsys):
+    """Listing files prints them numbered, in sorted order"""
+    (datadir / "[fig].png").write_binary(b"")
+    t = TarTeX([str(datadir / flsfile), "-l", "-a", "*.png,*.bib"])
+    t.tar_files()
+
+    output = capsys.readouterr().out.splitlines()
+    assert output == [
+        "1. [fig].png",
+        "2. main.bbl",
+        "3. main.tex",
+        "4. refs.bib",
+    ]
+
+
+def test_fls_deps_cached(tartex_obj):
+    """Input files are only looked up once per TarTeX object"""
+    assert tartex_obj.input_files() is tartex_obj.input_files()
+
+
+def test_fls_add_dir_large_file(datadir, flsfile, monkeypatch):
+    """User added dirs are included recursively and large files streamed"""
+    monkeypatch.setattr("tartex.tartex.TAR_READ_MAX", 16)
+    (datadir / "figs" / "sub").ensure(dir=True)
+    (datadir / "figs" / "sub" / "fig.png").write_binary(b"x" * 64)
+    t = TarTeX([str(datadir / flsfile), "-o", str(datadir), "-a", "figs"])
+    t.tar_files()
+
+    with tar.open(f"{t.tar_file!s}.{t.tar_ext}") as f:
+        assert f.getmember("figs").isdir()
+        assert f.extractfile("figs/sub/fig.png").read() == b"x" * 64
+        assert (
+            f.extractfile("main.tex").read()
+            == (datadir / "main.tex").read_binary()
+        )
+
+
+def test_fls_excl(datadir, flsfile, capsys):
+    """Existing files matching an exclude pattern are left out"""
+    (datadir / "main.bbl").write_binary(b"")
+    t = TarTeX([str(datadir / flsfile), "-l", "-x", "main.bbl"])
+    t.tar_files()
+
+    assert capsys.readouterr().out.splitlines() == ["1. main.tex"]
+
+
+def test_fls_supp_in_source(datadir, flsfile, tmp_path):
+    """Generated .bbl is only added separately if not among sources"""
+    t = TarTeX([str(datadir / flsfile)])
+    bbl = t.main_file.with_suffix(".bbl")
+    (tmp_path / bbl.name).write_bytes(b"bbl")  # As left by a LaTeX compile
+    assert t._missing_supp(bbl, tmp_path, {bbl.name}) is None
+    assert t._missing_supp(bbl, tmp_path, set()) == b"bbl"
+
+
+def test_fls_add_dup(datadir, flsfile, caplog):
+    """User files matched more than once are added once, with a warning"""
+    t = TarTeX([str(datadir / flsfile), "-l", "-a", "refs.bib,*.bib"])
+    t.tar_files()
+
+    assert sorted(t.input_files()) == ["main.bbl", "main.tex", "refs.bib"]
+    assert "Manually included file refs.bib already added" in caplog.text
@@ -7,6 +7,8 @@
 Tests for passing various TeX processors to latexmk
 """
 
+from pathlib import Path
+
 import pytest
 
 from tartex.tartex import TAR_DEFAULT_COMP, TarTeX
@@ -38,6 +40,13 @@ class TestLatexmkOpts:
         t.tar_files()
         assert t.tar_file.with_suffix(f".tar.{TAR_DEFAULT_COMP}").exists()
 
+    def test_auto_ps(self, basic_opts, datadir):
+        """Check: Automatic processing should use '-ps' with eps sources"""
+        Path(datadir, "figures").mkdir()
+        Path(datadir, "figures", "fig.eps").touch()
+        t = TarTeX(basic_opts)
+        assert t.force_tex == "ps"
+
     def test_ps(self, basic_opts):
         """Check: Processing using -ps"""
         basic_opts.extend(["--latexmk-tex", "ps"])